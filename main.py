@@ -11,10 +11,11 @@ It has the following features:
 
 # System modules
 import os
-import pickle  # The module we use to save and load state
+
+import msgspec
+import zstandard as zstd
 
 # Local modules
-import session
 import savestate
 
 GREETING = '''
@@ -27,6 +28,57 @@ Hello and welcome!
 
 STATEFILE = 'trainee.pkl'
 
+# The frame header zstd puts first in everything it compresses. Used to
+# tell compressed state files apart from legacy uncompressed ones.
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def _save_state(tstate: savestate.TraineeState) -> None:
+    '''Write the trainee state to STATEFILE, crash-safely
+
+    The state is written to a temporary file that is fsync'ed and then
+    atomically renamed over STATEFILE, so a crash or Ctrl-C mid-write
+    never leaves a truncated state file behind. Does nothing when there
+    are no unsaved changes.
+    '''
+    if not tstate.dirty:
+        return
+
+    blob = zstd.ZstdCompressor(level=3).compress(msgspec.msgpack.encode(tstate))
+
+    tmp_path = STATEFILE + '.tmp'
+    with open(tmp_path, 'wb') as fd:
+        fd.write(blob)
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.replace(tmp_path, STATEFILE)
+    tstate.mark_saved()
+
+
+def _load_state(statefile: str) -> savestate.TraineeState:
+    '''Load the trainee state from the given file
+
+    Old state files written with pickle are still understood. They get
+    migrated to msgpack the next time the state is saved.
+    '''
+    with open(statefile, 'rb') as fd:
+        data = fd.read()
+
+    if data.startswith(_ZSTD_MAGIC):
+        data = zstd.ZstdDecompressor().decompress(data)
+
+    try:
+        return msgspec.msgpack.decode(data, type=savestate.TraineeState)
+    except msgspec.DecodeError:
+        pass
+
+    try:
+        # A msgpack file with the old (addset, rmset) representation
+        return savestate.from_legacy_msgpack(data)
+    except msgspec.DecodeError:
+        # A state file from before the switch to msgpack
+        return savestate.from_legacy_pickle(data)
+
 
 def main() -> None:
     '''Voctrain main entry function'''
@@ -34,20 +86,29 @@ def main() -> None:
     print(GREETING)
 
     if os.path.exists(STATEFILE):
-        with open(STATEFILE, 'rb') as fd:
-            tstate = pickle.load(fd)
+        tstate = _load_state(STATEFILE)
+    elif os.path.exists(STATEFILE + '.tmp'):
+        # A crash happened between writing the new state and renaming
+        # it. The .tmp file holds a complete fsync'ed snapshot, so
+        # finish the interrupted rename; were we to load the .tmp file
+        # directly, the next save would rewrite our only copy in place.
+        os.replace(STATEFILE + '.tmp', STATEFILE)
+        tstate = _load_state(STATEFILE)
     else:
         # Create an empty initial TraineeState
         tstate = savestate.TraineeState()
 
+    # Imported here rather than at the top so that starting up (and
+    # bailing out early) doesn't pay for the whole session machinery
+    import session
+
     try:
-        session.run_session(tstate)
+        session.run_session(tstate, lambda: _save_state(tstate))
     except KeyboardInterrupt:
         print('\nCtrl-C pressed.\n'
               'Exiting vocabulary training. Saving level state.')
     finally:
-        with open(STATEFILE, 'wb') as fd:
-            pickle.dump(tstate, fd)
+        _save_state(tstate)
 
 
 main()
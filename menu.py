@@ -28,20 +28,25 @@ def choose(text: str, options: List, default: str = None) -> (str, Any):
     of the return tuple.
     '''
 
-    # Make sure the default is found as an option in the list
-    assert not default or default in [opt[0] for opt in options]
+    # Make sure the default is found as an option in the list. Wrapped
+    # in __debug__ so running with -O skips the whole check, and using
+    # a short-circuiting any() instead of building a throwaway list.
+    if __debug__ and default:
+        assert any(opt[0] == default for opt in options), \
+            f'default {default!r} not in options'
 
     def value_of(tup): return tup[1] if len(tup) > 2 else None
 
     # Create dict opt -> (opt,value)
     input_dict = dict((tup[0], (tup[0], value_of(tup))) for tup in options)
 
+    # The full prompt is the same on every retry, so put it together once
+    menu_text = '\n'.join([text]
+                          + [f' ({tup[0]}): {tup[-1]}' for tup in options]
+                          + ['\nYour choice: '])
+
     while True:
-        print(text)
-        for tup in options:
-            print(f' ({tup[0]}): {tup[-1]}')
-        print('\nYour choice:', end=' ')
-        inp = input()
+        inp = input(menu_text)
         if default and inp == '':
             inp = default
         if inp in input_dict:
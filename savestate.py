@@ -1,137 +1,260 @@
-'''
-    Class definitions for the user's training state that gets saved.
-
-    This is what gets saved through pickling of a TraineeState object:
-
-    * The current voc file the user has selected (if any)
-    - Per voc file:
-       * The level of the user
-       * Whether the user has qualified for examination
-       * Additional translations for english words
-       * Translations of an english word to not consider from the voc file
-'''
-
-
-class VocState:
-    '''Holds user related info given a specific vocabulary file
-
-    1. What level the user has
-    2. If the user is qualified to level up (take the exam)
-    3. Any extra allowed translations
-    '''
-
-    def __init__(self):
-        '''Setup defaults'''
-        self._level = 0           # Trainee level for this vocabulary set
-        self._is_qualified = False   # May take exam to level
-        self._extra_trans = {}    # Extra translations provided by user
-
-    def num_of_modifs(self):
-        '''Return the number of user added translation modifications'''
-        return sum(len(addrm[0] | addrm[1]) for addrm
-                   in self._extra_trans.values())
-
-    def change_translation(self,
-                           engword: str,
-                           add: set = set(),
-                           remove: set = set()):
-        '''Add and remove valid translations for a word
-
-        add - set of words to add
-        remove - set of words to remove
-        '''
-        addset, rmset = self._extra_trans.setdefault(engword, (set(), set()))
-        addset |= add
-        addset -= remove
-        rmset |= remove
-        rmset -= add
-
-    def get_modified_translations(self,
-                                  engword: str,
-                                  translations: list) -> set:
-        '''Apply corrections to a word's default translations
-
-        Modify a vocabulary's default list of allowed translations. The
-        function can add new allowed translations, but also remove one
-        or more translations from the given ones.
-
-        engword       - The english word
-        translations  - List of translations we start with
-
-        Returns a set of allowed translations
-        '''
-
-        addset, rmset = self._extra_trans.get(engword, (set(), set()))
-        result = set(translations)
-        result |= addset  # Add elements in addset to result
-        result -= rmset   # Remove elements in rmset from result
-        return result
-
-    def reset_modifications(self, engword: str):
-        '''Reset any modification to the translation of the given word'''
-        if engword in self._extra_trans:
-            del self._extra_trans[engword]
-
-    @property
-    def level(self): return self._level
-    @level.setter
-    def level(self, lev): self._level = lev
-
-    @property
-    def qualified(self): return self._is_qualified
-    @qualified.setter
-    def qualified(self, q): self._is_qualified = q
-
-
-class TraineeState:
-    '''Holds all state that should be persistent between runs'''
-
-    def __init__(self):
-        self._current_voc = ''          # File name of current vocabulary set
-        self._voc_states: VocState = {}  # The state objects per vocabulary
-
-    # The propery 'voc_file' reflects the user's current selected
-    # vocabulary. It can be both read and set.
-    @property
-    def voc_file(self): return self._current_voc
-    @voc_file.setter
-    def voc_file(self, filepath): self._current_voc = filepath
-
-    @property
-    def current_voc_state(self):
-        '''Return the current vocabulary user state.
-
-        This method creates, stores and returns a fresh state if it doesn't
-        previously exist.
-        '''
-        return self._voc_states.setdefault(self._current_voc, VocState())
-
-    def print_all_stats(self, maxlevel: int):
-        '''Print the current trainee status for all vocabularies
-
-        maxlevel    - Needed for nicer printout.
-        '''
-        print('\n------ Trainee states -----\n')
-        fmt = '%-2s%-30s%10s%15s%11s'
-        print(fmt %
-              ('', 'Vocabulary', 'Level', '#Translations', 'Qualified'))
-        print()
-
-        for k, v in self._voc_states.items():
-
-            # Decide what to write under "Qualified"
-            if v.level == maxlevel:
-                qual = 'Master'
-            elif v.qualified:
-                qual = 'Yes'
-            else:
-                qual = 'No'
-
-            # Decide the 'Current voc file' column tag
-            curstr = ' '
-            if k == self._current_voc:  # Mark current with '*'
-                curstr = '*'
-
-            print(fmt % (curstr, k, v.level, v.num_of_modifs(), qual))
-
-        print('\n    * = current selected vocabulary')
+'''
+    Class definitions for the user's training state that gets saved.
+
+    This is what gets saved through msgpack encoding of a TraineeState
+    object (see msgspec.msgpack):
+
+    * The current voc file the user has selected (if any)
+    - Per voc file:
+       * The level of the user
+       * Whether the user has qualified for examination
+       * Additional translations for english words
+       * Translations of an english word to not consider from the voc file
+'''
+
+import io
+import pickle  # Only used to read state files from older versions
+
+import msgspec
+
+
+class VocState(msgspec.Struct, dict=True):
+    '''Holds user related info given a specific vocabulary file
+
+    1. What level the user has
+    2. If the user is qualified to level up (take the exam)
+    3. Any extra allowed translations
+    '''
+
+    _level: int = 0              # Trainee level for this vocabulary set
+    _is_qualified: bool = False  # May take exam to level
+    # Extra translations provided by user, per english word. The inner
+    # dict maps translation -> True (added) or False (removed), so each
+    # modified translation is stored exactly once.
+    _extra_trans: dict[str, dict[str, bool]] = {}
+
+    def __post_init__(self):
+        # Not a struct field, so never serialized. Tracks whether this
+        # state has changes that are not yet saved to file.
+        self._dirty = False
+        # Cached total of num_of_modifs(), kept up to date by
+        # change_translation() and reset_modifications()
+        self._modif_count = sum(len(entry) for entry
+                                in self._extra_trans.values())
+
+    def num_of_modifs(self):
+        '''Return the number of user added translation modifications'''
+        return self._modif_count
+
+    def change_translation(self,
+                           engword: str,
+                           add: set = set(),
+                           remove: set = set()):
+        '''Add and remove valid translations for a word
+
+        add - set of words to add
+        remove - set of words to remove
+
+        A translation can only be in one state at a time: a later call
+        simply flips its entry, and `remove` wins if a word appears in
+        both arguments.
+        '''
+        entry = self._extra_trans.setdefault(engword, {})
+        old_size = len(entry)
+        entry.update(dict.fromkeys(add, True))
+        entry.update(dict.fromkeys(remove, False))
+        self._modif_count += len(entry) - old_size
+        self._dirty = True
+
+    def get_modified_translations(self,
+                                  engword: str,
+                                  translations: list) -> set:
+        '''Apply corrections to a word's default translations
+
+        Modify a vocabulary's default list of allowed translations. The
+        function can add new allowed translations, but also remove one
+        or more translations from the given ones.
+
+        engword       - The english word
+        translations  - List of translations we start with
+
+        Returns a set of allowed translations.
+
+        Translations are expected to be lowercase: the vocabulary
+        loader lowercases them and user additions come from already
+        lowercased input, so membership tests against a lowercased
+        answer need no further normalization.
+        '''
+
+        result = set(translations)
+        for word, added in self._extra_trans.get(engword, {}).items():
+            if added:
+                result.add(word)
+            else:
+                result.discard(word)
+        return result
+
+    def reset_modifications(self, engword: str):
+        '''Reset any modification to the translation of the given word'''
+        if engword in self._extra_trans:
+            self._modif_count -= len(self._extra_trans.pop(engword))
+            self._dirty = True
+
+    @property
+    def level(self): return self._level
+
+    @level.setter
+    def level(self, lev):
+        self._level = lev
+        self._dirty = True
+
+    @property
+    def qualified(self): return self._is_qualified
+
+    @qualified.setter
+    def qualified(self, q):
+        self._is_qualified = q
+        self._dirty = True
+
+
+class TraineeState(msgspec.Struct, dict=True):
+    '''Holds all state that should be persistent between runs'''
+
+    _current_voc: str = ''      # File name of current vocabulary set
+    # The state objects per vocabulary
+    _voc_states: dict[str, VocState] = {}
+
+    def __post_init__(self):
+        # Not a struct field, so never serialized. See VocState.
+        self._dirty = False
+
+    # The propery 'voc_file' reflects the user's current selected
+    # vocabulary. It can be both read and set.
+    @property
+    def voc_file(self): return self._current_voc
+
+    @voc_file.setter
+    def voc_file(self, filepath):
+        self._current_voc = filepath
+        self._dirty = True
+
+    @property
+    def dirty(self):
+        '''True if there are changes that have not been saved to file'''
+        return self._dirty or any(v._dirty for v in self._voc_states.values())
+
+    def mark_saved(self):
+        '''Record that the state is in sync with what is on file'''
+        self._dirty = False
+        for vstate in self._voc_states.values():
+            vstate._dirty = False
+
+    @property
+    def current_voc_state(self):
+        '''Return the current vocabulary user state.
+
+        This method creates, stores and returns a fresh state if it doesn't
+        previously exist.
+        '''
+        if self._current_voc not in self._voc_states:
+            self._voc_states[self._current_voc] = VocState()
+            self._dirty = True
+        return self._voc_states[self._current_voc]
+
+    def print_all_stats(self, maxlevel: int):
+        '''Print the current trainee status for all vocabularies
+
+        maxlevel    - Needed for nicer printout.
+        '''
+        print('\n------ Trainee states -----\n')
+        fmt = '%-2s%-30s%10s%15s%11s'
+        print(fmt %
+              ('', 'Vocabulary', 'Level', '#Translations', 'Qualified'))
+        print()
+
+        for k, v in self._voc_states.items():
+
+            # Decide what to write under "Qualified"
+            if v.level == maxlevel:
+                qual = 'Master'
+            elif v.qualified:
+                qual = 'Yes'
+            else:
+                qual = 'No'
+
+            # Decide the 'Current voc file' column tag
+            curstr = ' '
+            if k == self._current_voc:  # Mark current with '*'
+                curstr = '*'
+
+            print(fmt % (curstr, k, v.level, v.num_of_modifs(), qual))
+
+        print('\n    * = current selected vocabulary')
+
+
+class _LegacyState:
+    '''Stand-in for the plain classes found in old pickled state files'''
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    '''Unpickler that reads old state files without the old classes'''
+
+    def find_class(self, module, name):
+        if module == __name__ and name in ('TraineeState', 'VocState'):
+            return _LegacyState
+        return super().find_class(module, name)
+
+
+class _AddRmVocState(msgspec.Struct):
+    '''VocState layout from before the tri-state _extra_trans format'''
+    _level: int = 0
+    _is_qualified: bool = False
+    _extra_trans: dict[str, tuple[frozenset[str], frozenset[str]]] = {}
+
+
+class _AddRmTraineeState(msgspec.Struct):
+    '''TraineeState layout matching _AddRmVocState'''
+    _current_voc: str = ''
+    _voc_states: dict[str, _AddRmVocState] = {}
+
+
+def _upgrade(old) -> TraineeState:
+    '''Build a TraineeState from one of the legacy representations
+
+    Both legacy formats store extra translations as (addset, rmset)
+    pairs; those are fed through change_translation so the tri-state
+    representation and its caches come out consistent.
+    '''
+    tstate = TraineeState()
+    tstate._current_voc = old._current_voc
+    for vocfile, oldvoc in old._voc_states.items():
+        vstate = VocState()
+        vstate._level = oldvoc._level
+        vstate._is_qualified = oldvoc._is_qualified
+        for engword, (add, remove) in oldvoc._extra_trans.items():
+            vstate.change_translation(engword, set(add), set(remove))
+        tstate._voc_states[vocfile] = vstate
+
+    # Make sure the migrated state gets rewritten in the new format
+    tstate._dirty = True
+    return tstate
+
+
+def from_legacy_msgpack(data: bytes) -> TraineeState:
+    '''Build a TraineeState from a msgpack state file with the old
+    (addset, rmset) representation of extra translations
+
+    Raises msgspec.DecodeError if the data is not such a file.
+    '''
+    return _upgrade(msgspec.msgpack.decode(data, type=_AddRmTraineeState))
+
+
+def from_legacy_pickle(data: bytes) -> TraineeState:
+    '''Build a TraineeState from a state file written with pickle
+
+    data    - the raw bytes of the old state file
+
+    Returns an equivalent TraineeState. Used to migrate state files
+    from versions that saved with pickle instead of msgpack.
+    '''
+    return _upgrade(_LegacyUnpickler(io.BytesIO(data)).load())
@@ -3,8 +3,8 @@ User interaction and state update logic in voctrain application
 '''
 
 import os
-from typing import List, Tuple, Dict
-import random
+from dataclasses import dataclass
+from typing import List
 
 # Local modules
 from savestate import TraineeState, VocState
@@ -17,8 +17,21 @@ _NUMWORDS = 10
 
 _MAXLEVEL = 10
 
-# The type of the list we construct from the vocabulary file
-VocTable = List[Tuple[str, List[str]]]
+
+@dataclass
+class VocLevel:
+    '''One level's worth of vocabulary, stored as parallel lists
+
+    words[i] and translations[i] belong to each other. Keeping the
+    columns separate makes a level a plain pair of lists that can be
+    picked and indexed without building any per-session dict.
+    '''
+    words: List[str]                  # The english words
+    translations: List[frozenset]     # Allowed translations per word
+
+
+# The type of the table we construct from the vocabulary file
+VocTable = List[VocLevel]
 
 
 def _read_voc(tstate: TraineeState) -> VocTable:
@@ -28,19 +41,26 @@ def _read_voc(tstate: TraineeState) -> VocTable:
 
     tstate   -  A trainee state object
 
-    returns a list of words and their translations.
+    returns the vocabulary as a list of VocLevel objects, one per
+    _NUMWORDS-sized level.
 
     '''
-    voctable = []
-
+    # Read the whole file in one go instead of line by line
     with open(tstate.voc_file, 'tr') as fd:
-        for line in fd:
-            _, translations, engword = line.split('\t')
-            # Allow for comma separated multiple translations of eng word
-            voctable.append((engword.strip(),
-                             [t.strip() for t in translations.split(',')]))
+        lines = fd.read().splitlines()
+
+    # Each line is '<num>\t<translations>\t<engword>'. Allow for comma
+    # separated multiple translations of the eng word. Translations are
+    # lowercased here once, so answers (which get lowercased on input)
+    # can be matched with a plain membership test.
+    rows = [line.split('\t', 2) for line in lines]
+    words = [engword.strip() for _, _, engword in rows]
+    trans = [frozenset(t.strip().lower() for t in translations.split(','))
+             for _, translations, _ in rows]
 
-    return voctable
+    # Pre-slice the columns into one VocLevel per level
+    return [VocLevel(words[i:i + _NUMWORDS], trans[i:i + _NUMWORDS])
+            for i in range(0, len(words), _NUMWORDS)]
 
 
 def _print_banner(text: str, width: int):
@@ -75,11 +95,14 @@ def _switch_voc(tstate: TraineeState) -> str:
 
     i = 1
     menuopts = []
-    files = [f for f in os.listdir('.') if os.path.isfile(f)]
-    for f in files:
-        if f.endswith('_voc.txt'):
-            menuopts.append((str(i), f, f'The vocfile {f}'))
-            i += 1
+    # scandir gets the file type from the directory listing itself,
+    # so this needs no stat call per entry
+    with os.scandir('.') as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith('_voc.txt'):
+                menuopts.append((str(i), entry.name,
+                                 f'The vocfile {entry.name}'))
+                i += 1
 
     # If no _voc.txt file was found
     if not menuopts:
@@ -100,52 +123,74 @@ def _switch_voc(tstate: TraineeState) -> str:
     return tstate.voc_file != old_voc_file
 
 
-def _setup_test(vstate: VocState, voctable: VocTable) -> Dict[str, List[str]]:
-    '''Return dict of default translations for given level
+def _iter_bits(mask: int):
+    '''Yield the indices of the set bits in mask, lowest first
+
+    mask    - A non-negative int used as a bit set
+    '''
+    while mask:
+        low = mask & -mask       # Isolate the lowest set bit
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def _setup_test(vstate: VocState, voctable: VocTable) -> VocLevel:
+    '''Return the vocabulary level the trainee currently is on
 
     vstate      - trainee state for given (=current) vocabulary
     voctable    - full table (= all levels) of vocabulary
 
-    returns a dict where key is the english word and value is a list of
-    translations as found in the vocabulary file.
+    returns the VocLevel with the words and translations to test. If
+    the file has fewer than _MAXLEVEL levels the trainee can level past
+    its end; such a level is returned as an empty VocLevel, which the
+    training and exam loops treat as an immediate pass.
     '''
-    startix = _NUMWORDS * vstate.level
-    return dict((voctable[startix:startix + _NUMWORDS]))
+    if vstate.level < len(voctable):
+        return voctable[vstate.level]
+    return VocLevel([], [])
 
 
-def _take_exam(vstate: VocState, voctable: VocTable):
+def _take_exam(vstate: VocState, voctable: VocTable, save_state):
     '''Take the exam to try level up
 
     vstate      - trainee state for given (=current) vocabulary
     voctable    - full table (= all levels) of vocabulary
+    save_state  - callback that persists the trainee state
     '''
+    # Deferred so just starting the program doesn't import random
+    import random
 
-    vocdict = _setup_test(vstate, voctable)
+    level = _setup_test(vstate, voctable)
+    # Resolve each word's modified translations once for the whole exam
+    trans_cache = [vstate.get_modified_translations(w, t)
+                   for w, t in zip(level.words, level.translations)]
     # Randomize the order we test
-    testwords = list(vocdict.keys())
-    random.shuffle(testwords)
+    order = random.sample(range(len(level.words)), len(level.words))
 
     _clear_screen()
     _print_banner(f'LEVEL {vstate.level + 1} EXAM!', 40)
 
-    for num, engword in enumerate(testwords):
-        translations = vstate.get_modified_translations(
-            engword, vocdict[engword])
-        print(f'{num + 1}: How do you say \'{engword}\'? ', end='')
-        answer = input().lower()
-        if answer in translations:
-            print('  Correct!')
-            del vocdict[engword]  # Remove it from the rest of the session.
+    # Bind the builtins used per question to locals; local lookups are
+    # cheaper than global ones in the interpreter
+    _input, _print = input, print
+
+    passed = True
+    for num, ix in enumerate(order):
+        answer = _input(
+            f'{num + 1}: How do you say \'{level.words[ix]}\'? ').lower()
+        if answer in trans_cache[ix]:
+            _print('  Correct!')
         else:
+            passed = False
             break  # No use to continue the exam...
 
-    if not vocdict:
+    if passed:
         print('\nYou finished the exam with no errors! Good work!')
         vstate.level += 1
         vstate.qualified = False  # Not qualified any longer!
+        save_state()  # A hard kill should not cost the trainee a level
         print(f'Level up! New level for this vocabulary is {vstate.level}.')
-        print('Press return', end='')
-        input()
+        input('Press return')
     else:
         print('\nYou failed the exam. Better luck next time!')
 
@@ -190,60 +235,79 @@ def _modify_translation(engword: str,
         vstate.change_translation(engword, add={answer}, remove={replaceword})
 
 
-def _train(vstate: VocState, voctable: VocTable):
+def _train(vstate: VocState, voctable: VocTable, save_state):
     '''Run a training session
 
     vstate      - trainee state for given (=current) vocabulary
     voctable    - full table (= all levels) of vocabulary
+    save_state  - callback that persists the trainee state
     '''
+    # Deferred so just starting the program doesn't import random
+    import random
 
-    vocdict = _setup_test(vstate, voctable)
+    level = _setup_test(vstate, voctable)
 
     _print_banner(f'Level {vstate.level} training session', 40)
 
-    def get_translations(engword):
-        return vstate.get_modified_translations(engword, vocdict[engword])
+    # Resolve each word's modified translations once up front. Entries
+    # are refreshed only when the user edits a word's translations.
+    trans_cache = [vstate.get_modified_translations(w, t)
+                   for w, t in zip(level.words, level.translations)]
+
+    # Bind names used per question to locals; local lookups are cheaper
+    # than global and attribute lookups in the interpreter
+    _input, _print = input, print
+    _get_modified = vstate.get_modified_translations
 
+    # Bitmask over the word indices not yet answered correctly this
+    # session; bit ix set means level.words[ix] is still to be done
+    remaining = (1 << len(level.words)) - 1
     keepon = True
 
     while keepon:
         # Randomize the order of remaining words
-        testwords = list(vocdict.keys())
-        numwords = len(testwords)
-        random.shuffle(testwords)
+        numwords = remaining.bit_count()
+        order = random.sample(list(_iter_bits(remaining)), numwords)
 
-        print(f'Starting test round of {len(testwords)} words.\n')
+        print(f'Starting test round of {numwords} words.\n')
 
-        for num, engword in enumerate(testwords):
-            translations = get_translations(engword)
-            print(f'{num + 1}: How do you say \'{engword}\'? ', end='')
-            answer = input().lower()
+        for num, ix in enumerate(order):
+            engword = level.words[ix]
+            translations = trans_cache[ix]
+            answer = _input(
+                f'{num + 1}: How do you say \'{engword}\'? ').lower()
             if answer not in translations:
                 # Ok - wrong answer. Give the user a chance to add the
                 # word to the vocabulary
                 correct = " or ".join(f"'{w}'" for w in translations)
-                print(f'Not correct. It should be {correct}.')
+                _print(f'Not correct. It should be {correct}.')
                 _modify_translation(engword, answer, translations, vstate)
+                # The user may have edited this word - refresh its entry
+                # and checkpoint the (possibly) changed state
+                trans_cache[ix] = _get_modified(engword,
+                                                level.translations[ix])
+                save_state()
             else:
-                print('  Correct!')
-                del vocdict[engword]  # Remove it from the rest of the session.
+                _print('  Correct!')
+                # Done for the rest of the session - clear its bit
+                remaining &= ~(1 << ix)
 
-        if not vocdict:  # If all words been translated correctly at least once
+        if not remaining:  # If all words translated correctly at least once
             print('\nYou seem to know all the words!')
             if not vstate.qualified:
                 if vstate.level < _MAXLEVEL:
                     print('You are now qualfied to take the exam!')
                 vstate.qualified = True
+                save_state()  # Qualification should survive a hard kill
             keepon = False
 
         else:  # There are still words we've not translated correctly
             print('\nDone. You got '
-                  f'{numwords - len(vocdict)}/{numwords} correct!\n')
+                  f'{numwords - remaining.bit_count()}/{numwords} correct!\n')
             print('Difficult words:')
             print('----------------')
-            for engword in vocdict.keys():
-                translations = get_translations(engword)
-                print(f'  {engword} -> {", ".join(translations)}')
+            for ix in _iter_bits(remaining):
+                print(f'  {level.words[ix]} -> {", ".join(trans_cache[ix])}')
 
             # At this point the user can exit the training if they like
 
@@ -256,10 +320,13 @@ def _train(vstate: VocState, voctable: VocTable):
                 _clear_screen()
 
 
-def run_session(tstate: TraineeState):
+def run_session(tstate: TraineeState, save_state):
     '''Main menu logic.
 
-    tstate - The state that got read from file
+    tstate      - The state that got read from file
+    save_state  - callback that persists tstate; called after important
+                  progress (level up, qualification, translation edits)
+                  so a hard kill loses as little as possible
 
     This functions run until the user selects the 'q' option (quit).
     From here one can select different vocabularies, train and do an
@@ -316,9 +383,9 @@ def run_session(tstate: TraineeState):
             print('Ok. See you soon!')
             remain_running = False
         elif choice == 't':
-            _train(tstate.current_voc_state, voctable)
+            _train(tstate.current_voc_state, voctable, save_state)
         elif choice == 'e':
-            _take_exam(tstate.current_voc_state, voctable)
+            _take_exam(tstate.current_voc_state, voctable, save_state)
         elif choice == 'l':
             tstate.print_all_stats(_MAXLEVEL)
             print()